@@ -1,17 +1,14 @@
+import io
 import os
 import math
 from typing import List
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
-
-try:
-    from PIL import Image, ImageOps
-    PIL_AVAILABLE = True
-except Exception:
-    PIL_AVAILABLE = False
+import plotly.io as pio
 
 st.set_page_config(
     page_title="Bank Customer Segmentation",
@@ -46,52 +43,222 @@ BUBBLE_PALETTE = [
     "#264653",  # dark teal
 ]
 
+# Shared layout defaults live in one template instead of per-figure
+# update_layout calls, so each figure's JSON payload doesn't repeat them.
+# Legend titles stay per-figure: not every legend lists clusters.
+pio.templates["dashboard"] = go.layout.Template(
+    layout=dict(
+        bargap=0.15,
+        colorway=list(CLUSTER_PALETTE.values()),
+    )
+)
+pio.templates.default = "plotly_white+dashboard"
+
 # ----------------------------
 # Data Loading
 # ----------------------------
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CSV_PATH = os.path.join(BASE_DIR, "top_kpis.csv")
+PARQUET_PATH = os.path.join(BASE_DIR, "top_kpis.parquet")
+
+# Declared up front so read_csv parses straight into the final types;
+# 32-bit numerics halve the bytes every downstream groupby has to touch.
+NUM_DTYPES = {
+    "CustomerCount": "int32",
+    "AvgAge": "float32",
+    "AvgRecency": "float32",
+    "AvgFrequency": "float32",
+    "AvgAvgMonetary": "float32",
+    "AvgTotalMonetary": "float32",
+}
 
 @st.cache_data(show_spinner=False)
-def load_csv(path: str) -> pd.DataFrame:
-    if not os.path.exists(path):
+def load_data(csv_path: str, parquet_path: str) -> pd.DataFrame:
+    """Load the KPI table, preferring the Parquet copy.
+
+    Parquet preserves column types (including the categorical keys), so a
+    warm start skips CSV text parsing and numeric coercion entirely. The
+    first run converts the CSV once and persists the Parquet next to it.
+    """
+    if os.path.exists(parquet_path):
+        df = pd.read_parquet(parquet_path)
+    elif os.path.exists(csv_path):
+        df = pd.read_csv(csv_path, dtype=NUM_DTYPES)
+        try:
+            df.to_parquet(parquet_path, index=False)
+        except Exception:
+            pass  # read-only deployments keep working from the CSV
+    else:
         st.error("Data file not found. Place 'top_kpis.csv' next to app.py.")
         st.stop()
-    return pd.read_csv(path)
+    # Normalize dtypes after either branch: integer categories don't
+    # round-trip through Parquet, and a Parquet written by an older build
+    # may still carry 64-bit numerics. The casts are no-ops when the
+    # columns already have the target dtype. Only cast columns that exist,
+    # so a malformed data file still reaches the friendly required-columns
+    # check below instead of dying here with a raw KeyError.
+    df = df.astype({c: t for c, t in NUM_DTYPES.items() if c in df.columns})
+    # Categorical keys: downstream filters compare small integer codes
+    # instead of hashing Python strings row by row.
+    for key in ("CustLocation", "Cluster"):
+        if key in df.columns:
+            df[key] = df[key].astype("category")
+    return df
+
+df = load_data(CSV_PATH, PARQUET_PATH)
 
-df = load_csv(CSV_PATH)
+# ----------------------------
+# Figure Builders (cached)
+# ----------------------------
+# The aggregated frames these receive are tiny (cities × clusters), so the
+# content hash on the cache key is cheap; repeat renders with unchanged
+# inputs skip rebuilding the Plotly figure payload entirely.
+
+@st.cache_data(show_spinner=False)
+def build_stacked_bar(pivot: pd.DataFrame, n_cities: int) -> go.Figure:
+    # One go.Bar per cluster column of the wide pivot — no px
+    # DataFrame-to-trace conversion pass.
+    cities = pivot["CustLocation"].tolist()
+    fig = go.Figure([
+        go.Bar(x=cities, y=pivot[c], name=str(c), marker_color=CLUSTER_PALETTE.get(int(c)))
+        for c in pivot.columns if c != "CustLocation"
+    ])
+    fig.update_layout(
+        barmode="stack",
+        title=f"Customer Distribution by City & Segment — {n_cities} cities (page view)",
+        legend_title_text="Cluster", xaxis_title="City", yaxis_title="Customers",
+    )
+    return fig
+
+
+@st.cache_data(show_spinner=False)
+def build_heatmap(heat: pd.DataFrame) -> go.Figure:
+    # Hand imshow a bare float32 array with explicit axes: no DataFrame
+    # introspection inside Plotly Express and half the bytes serialized.
+    return px.imshow(
+        heat.to_numpy(dtype=np.float32),
+        x=list(heat.columns),
+        y=list(heat.index),
+        labels=dict(color="Avg Total Monetary"),
+        aspect="auto",
+        title="Avg Total Monetary — Heatmap",
+        color_continuous_scale="Tealrose",
+    )
+
+
+@st.cache_data(show_spinner=False)
+def build_treemap(treemap_df: pd.DataFrame) -> go.Figure:
+    return px.treemap(
+        treemap_df,
+        path=["CustLocation", "Cluster"],
+        values="CustomerCount",
+        color="Cluster",
+        color_discrete_map=CLUSTER_PALETTE,
+        title="Customer Mix Treemap",
+        maxdepth=2,
+    )
+
+
+@st.cache_data(show_spinner=False)
+def build_city_totals_bar(city_totals_df: pd.DataFrame) -> go.Figure:
+    fig = go.Figure(go.Bar(
+        x=city_totals_df["CustLocation"].tolist(),
+        y=city_totals_df["CustomerCount"],
+        marker_color=PRIMARY,
+    ))
+    fig.update_layout(title="Total Customers by City", xaxis_title="CustLocation", yaxis_title="CustomerCount")
+    return fig
+
+
+@st.cache_data(show_spinner=False)
+def build_radar(prof_plot: pd.DataFrame, pick: tuple, categories: tuple) -> go.Figure:
+    fig = go.Figure()
+    cats = list(categories)
+    for city in pick:
+        row = prof_plot[prof_plot["CustLocation"] == city][cats].iloc[0].tolist()
+        row.append(row[0])
+        fig.add_trace(go.Scatterpolar(r=row, theta=cats + [cats[0]], fill='toself', name=city, opacity=0.5))
+    fig.update_layout(title="City Profile — Normalized Metrics", polar=dict(radialaxis=dict(visible=True, range=[0, 1])), showlegend=True)
+    return fig
+
+
+@st.cache_data(show_spinner=False)
+def build_mix_bar(mix: pd.DataFrame) -> go.Figure:
+    fig = go.Figure([
+        go.Bar(x=sub["CustLocation"].tolist(), y=sub["CustomerCount"], name=str(int(c)),
+               marker_color=CLUSTER_PALETTE.get(int(c)))
+        for c, sub in mix.groupby("Cluster", observed=True)
+    ])
+    fig.update_layout(
+        barmode="group", title="Segment Mix by City (Customers)",
+        legend_title_text="Cluster", xaxis_title="City", yaxis_title="Customers",
+    )
+    return fig
+
+
+@st.cache_data(show_spinner=False)
+def build_metrics_line(avg_metrics: pd.DataFrame) -> go.Figure:
+    return px.line(
+        avg_metrics.melt(id_vars="CustLocation", var_name="Metric", value_name="Value"),
+        x="CustLocation", y="Value", color="Metric", markers=True,
+        title="Average Metrics by City",
+    )
+
+
+@st.cache_data(show_spinner=False)
+def build_bubble(seg_summary: pd.DataFrame) -> go.Figure:
+    # WebGL traces render on the GPU; one trace per cluster keeps the
+    # per-segment legend px.scatter used to provide.
+    sizeref = 2.0 * seg_summary["CustomerCount"].max() / (64 ** 2) if len(seg_summary) else 1.0
+    fig = go.Figure()
+    for i, row in enumerate(seg_summary.itertuples(index=False)):
+        cid = int(row.Cluster)
+        fig.add_trace(go.Scattergl(
+            x=[row.AvgFrequency], y=[row.AvgTotalMonetary], mode="markers", name=str(cid),
+            marker=dict(
+                size=[row.CustomerCount], sizemode="area", sizeref=sizeref,
+                color=BUBBLE_PALETTE[i % len(BUBBLE_PALETTE)],
+                line=dict(width=1, color="white"),
+            ),
+            hovertemplate=(
+                f"Cluster={cid}<br>AvgFrequency=%{{x}}<br>AvgTotalMonetary=%{{y}}<br>"
+                f"AvgAge={row.AvgAge}<br>AvgRecency={row.AvgRecency}<br>"
+                f"CustomerCount={int(row.CustomerCount):,}<extra></extra>"
+            ),
+        ))
+    fig.update_layout(
+        title="Segment Positioning (Frequency vs. Spend)",
+        legend_title_text="Cluster", xaxis_title="AvgFrequency", yaxis_title="AvgTotalMonetary",
+    )
+    return fig
 
 # ----------------------------
 # Header
 # ----------------------------
-    st.markdown(
-        "<div style='width:100%; display:flex; justify-content:center; margin-top:6px; margin-bottom:10px;'>"
-        "<h1 style='margin:0; white-space:nowrap;'>🇮🇳 Bank Customer Segmentation Dashboard</h1>"
-        "</div>",
-        unsafe_allow_html=True,
-    )
+st.markdown(
+    "<div style='width:100%; display:flex; justify-content:center; margin-top:6px; margin-bottom:10px;'>"
+    "<h1 style='margin:0; white-space:nowrap;'>🇮🇳 Bank Customer Segmentation Dashboard</h1>"
+    "</div>",
+    unsafe_allow_html=True,
+)
 
 
 # ----------------------------
 # Banner (auto, no uploader)
 # ----------------------------
-# We will look for a local image to render as a banner. Recommended size ~1400x350.
+# The banner is pre-sized once by make_banner.py; at runtime we just show
+# the cached WebP. The raw-image fallback only kicks in when the cached
+# file is missing (e.g. a fresh source image before re-running the script).
+BANNER_PATH = "banner_1400x350.webp"
 BANNER_CANDIDATES = [
     "India_map.png", "india_map.png", "india.png", "banner.png", "map.png"
 ]
-_banner_path = next((p for p in BANNER_CANDIDATES if os.path.exists(p)), None)
-if _banner_path:
-    if PIL_AVAILABLE:
-        try:
-            img = Image.open(_banner_path).convert("RGB")
-            # Fit to 1400x350 (crop if needed) for a sleek banner strip
-            target_size = (1400, 350)
-            img_fit = ImageOps.fit(img, target_size, method=Image.Resampling.LANCZOS, centering=(0.5, 0.5))
-            st.image(img_fit, use_container_width=True)
-        except Exception:
-            st.image(_banner_path, use_container_width=True)
-    else:
+if os.path.exists(BANNER_PATH):
+    st.image(BANNER_PATH, use_container_width=True)
+else:
+    _banner_path = next((p for p in BANNER_CANDIDATES if os.path.exists(p)), None)
+    if _banner_path:
         st.image(_banner_path, use_container_width=True)
 
 # ----------------------------
@@ -107,12 +274,117 @@ if missing:
     st.error(f"Missing required columns: {missing}")
     st.stop()
 
-num_cols = [c for c in df.columns if c not in ["CustLocation", "Cluster"]]
-for c in num_cols:
-    df[c] = pd.to_numeric(df[c], errors="coerce")
+# The category arrays are already sorted and NaN-free, so the sidebar
+# domains come straight off the dtype instead of a dropna/unique/sort
+# scan over the column on every rerun.
+all_cities: List[str] = df["CustLocation"].cat.categories.tolist()
+all_clusters: List[int] = df["Cluster"].cat.categories.tolist()
 
-all_cities: List[str] = sorted(df["CustLocation"].dropna().unique().tolist())
-all_clusters: List[int] = sorted(df["Cluster"].dropna().unique().tolist())
+
+@st.cache_data(show_spinner=False)
+def global_kpis() -> tuple:
+    """Headline KPI tuple over the full table; independent of any filter.
+
+    Closes over the module-level `df` like the filter helpers do, so the
+    cache key is constant and the lookup never hashes the frame. (An
+    identity-keyed DataFrame argument would not work: load_data is an
+    st.cache_data function, so `df` is a fresh unpickled copy each rerun.)
+    """
+    total = int(df["CustomerCount"].sum())
+    n_cities = df["CustLocation"].nunique()
+    n_segments = df["Cluster"].nunique()
+    # Promote to float64 for the weighted mean: a float32 accumulation over
+    # count-weighted spend loses precision the headline metric would show.
+    num = (df["AvgTotalMonetary"].to_numpy(np.float64) * df["CustomerCount"].to_numpy(np.float64)).sum()
+    weighted_spend = float(num / total)
+    return total, n_cities, n_segments, weighted_spend
+
+# ----------------------------
+# Filtering Pipeline (cached)
+# ----------------------------
+# These helpers close over the module-level `df` from `load_data` and key
+# the cache purely on widget state. That works because `df`'s *content* is
+# stable for the process lifetime — its identity is not, since st.cache_data
+# hands back a fresh copy each rerun — so widget state alone determines the
+# result. Repeat renders with the same selections become an O(1) cache
+# lookup instead of re-running the mask/groupby/sort pipeline.
+
+def _selection_mask(city_sel: tuple, cluster_sel: tuple) -> np.ndarray:
+    """One boolean mask for both filters via integer category codes.
+
+    `np.isin` on the int8/int16 code arrays stays in a NumPy C loop, versus
+    `.isin` hashing every string/object value twice.
+    """
+    city_codes = df["CustLocation"].cat.categories.get_indexer(city_sel)
+    cluster_codes = df["Cluster"].cat.categories.get_indexer(cluster_sel)
+    return (
+        np.isin(df["CustLocation"].cat.codes.to_numpy(), city_codes)
+        & np.isin(df["Cluster"].cat.codes.to_numpy(), cluster_codes)
+    )
+
+
+@st.cache_data(show_spinner=False)
+def candidate_city_list(city_sel: tuple, cluster_sel: tuple, topn) -> tuple:
+    """Sorted cities that survive the selection and optional Top‑N filters."""
+    fdf_base = df.loc[_selection_mask(city_sel, cluster_sel)]
+    if topn:
+        city_totals_all = (
+            fdf_base.groupby("CustLocation", observed=True)["CustomerCount"].sum().sort_values(ascending=False)
+        )
+        return tuple(sorted(city_totals_all.head(topn).index.tolist()))
+    return tuple(sorted(fdf_base["CustLocation"].unique().tolist()))
+
+
+@st.cache_data(show_spinner=False)
+def compute_filtered(city_sel: tuple, cluster_sel: tuple, topn, page_size: int, page: int, show_all: bool):
+    """Apply selection, Top‑N and pagination; return (filtered frame, visible cities)."""
+    # .loc with a boolean mask already yields a fresh frame, and everything
+    # downstream is read-only aggregation, so no defensive .copy() needed.
+    fdf_base = df.loc[_selection_mask(city_sel, cluster_sel)]
+    candidates = candidate_city_list(city_sel, cluster_sel, topn)
+    if show_all:
+        current_cities = list(candidates)
+    else:
+        start = (page - 1) * page_size
+        current_cities = list(candidates[start:start + page_size])
+    keep_codes = fdf_base["CustLocation"].cat.categories.get_indexer(current_cities)
+    fdf = fdf_base.loc[np.isin(fdf_base["CustLocation"].cat.codes.to_numpy(), keep_codes)]
+    return fdf, current_cities
+
+
+@st.cache_data(show_spinner=False)
+def city_metric_means(fdf: pd.DataFrame, cols: tuple) -> pd.DataFrame:
+    """Per-city means of `cols` computed in one contiguous NumPy pass.
+
+    Sorts the rows by city code once, then np.add.reduceat sums every
+    column per city run in a single sweep over the (rows, len(cols))
+    array, instead of pandas reducing the groupby column by column.
+    """
+    if not len(fdf):
+        return pd.DataFrame(columns=["CustLocation", *cols])
+    codes = fdf["CustLocation"].cat.codes.to_numpy()
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    vals = fdf.iloc[order][list(cols)].to_numpy(np.float64)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    sums = np.add.reduceat(vals, starts, axis=0)
+    counts = np.diff(np.r_[starts, len(codes)])
+    out = pd.DataFrame(sums / counts[:, None], columns=list(cols))
+    out.insert(0, "CustLocation", fdf["CustLocation"].cat.categories[codes[starts]])
+    return out
+
+
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(fdf: pd.DataFrame) -> bytes:
+    """Encode the filtered frame once per filter state for the download button."""
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+        buf = io.BytesIO()
+        pacsv.write_csv(pa.Table.from_pandas(fdf, preserve_index=False), buf)
+        return buf.getvalue()
+    except Exception:
+        return fdf.to_csv(index=False).encode("utf-8")
 
 # ----------------------------
 # Sidebar Filters & Controls
@@ -132,58 +404,69 @@ st.sidebar.markdown("### 📄 Display: City Pagination")
 page_size = st.sidebar.slider("Cities per page", 5, 15, 10)
 show_all = st.sidebar.checkbox("Show all cities (override pagination)", value=False)
 
-# Base filtered frame
-fdf_base = df[df["CustLocation"].isin(city_sel) & df["Cluster"].isin(cluster_sel)].copy()
-if topn:
-    city_totals_all = (
-        fdf_base.groupby("CustLocation")["CustomerCount"].sum().sort_values(ascending=False)
-    )
-    keep_cities = city_totals_all.head(topn).index.tolist()
-    fdf_base = fdf_base[fdf_base["CustLocation"].isin(keep_cities)]
-
+# Base filtered frame (cached on widget state)
 if show_all:
-    fdf = fdf_base.copy()
-    current_cities = sorted(fdf["CustLocation"].unique().tolist())
+    page = 1
 else:
-    candidate_cities = sorted(fdf_base["CustLocation"].unique().tolist())
+    candidate_cities = candidate_city_list(tuple(city_sel), tuple(cluster_sel), topn)
     total_pages = max(1, math.ceil(len(candidate_cities) / page_size))
     page = st.sidebar.number_input("City page", min_value=1, max_value=total_pages, value=1, step=1)
-    start = (page - 1) * page_size
-    end = start + page_size
-    current_cities = candidate_cities[start:end]
-    fdf = fdf_base[fdf_base["CustLocation"].isin(current_cities)].copy()
+
+fdf, current_cities = compute_filtered(tuple(city_sel), tuple(cluster_sel), topn, page_size, page, show_all)
+
+# ----------------------------
+# Shared Aggregates
+# ----------------------------
+# One groupby pass over `fdf` feeds every chart below; the per-tab pivots,
+# mixes and summaries are cheap views of this frame instead of each tab
+# re-reducing `fdf` on the same keys.
+agg = (
+    fdf.groupby(["CustLocation", "Cluster"], observed=True)
+    .agg(
+        CustomerCount=("CustomerCount", "sum"),
+        AvgAge=("AvgAge", "mean"),
+        AvgRecency=("AvgRecency", "mean"),
+        AvgFrequency=("AvgFrequency", "mean"),
+        AvgTotalMonetary=("AvgTotalMonetary", "mean"),
+    )
+)
+city_totals = agg["CustomerCount"].groupby(level="CustLocation", observed=True).sum()
 
 # ----------------------------
 # KPI Row
 # ----------------------------
+total_customers, n_cities, n_segments, weighted_spend = global_kpis()
 col1, col2, col3, col4 = st.columns(4)
 with col1:
-    st.metric("Total Customers", f"{int(df['CustomerCount'].sum()):,}")
+    st.metric("Total Customers", f"{total_customers:,}")
 with col2:
-    st.metric("Cities", df["CustLocation"].nunique())
+    st.metric("Cities", n_cities)
 with col3:
-    st.metric("Segments", df["Cluster"].nunique())
+    st.metric("Segments", n_segments)
 with col4:
-    weighted_spend = (df["AvgTotalMonetary"] * df["CustomerCount"]).sum() / df["CustomerCount"].sum()
     st.metric("Avg Spend per Customer", f"{weighted_spend:,.2f}")
 
 st.markdown("---")
 
 # ----------------------------
-# Tabs (Executive Summary first)
+# Views (Executive Summary first)
 # ----------------------------
-summary_tab, overview_tab, city_tab, segment_tab, details_tab = st.tabs([
+# st.tabs executes every tab body on every rerun even though only one is
+# visible; a radio-driven view only runs the active section, so the other
+# four skip their aggregation and figure work entirely.
+VIEW_NAMES = [
     "Executive Summary",
     "Overview",
     "City Deep‑Dive",
     "Segment Explorer",
     "Data & Notes",
-])
+]
+view = st.radio("View", VIEW_NAMES, horizontal=True, label_visibility="collapsed")
 
 # ----------------------------
 # Executive Summary (polished; reads file if present)
 # ----------------------------
-with summary_tab:
+if view == "Executive Summary":
     st.subheader("Key Takeaways")
     # Try to read user's interpretations if provided
     interp_path = "cluster_interpretations.txt"
@@ -211,55 +494,29 @@ with summary_tab:
 # ----------------------------
 # Overview Tab
 # ----------------------------
-with overview_tab:
+if view == "Overview":
     lcol, rcol = st.columns([1.2, 1])
 
     with lcol:
-        pivot = (
-            fdf.pivot_table(index="CustLocation", columns="Cluster", values="CustomerCount", aggfunc="sum", fill_value=0)
-            .reset_index()
-        )
-        pivot_long = pivot.melt(id_vars="CustLocation", var_name="Cluster", value_name="CustomerCount")
-        fig_bar = px.bar(
-            pivot_long,
-            x="CustLocation",
-            y="CustomerCount",
-            color="Cluster",
-            color_discrete_map=CLUSTER_PALETTE,
-            barmode="stack",
-            title=f"Customer Distribution by City & Segment — {len(current_cities)} cities (page view)",
-        )
-        fig_bar.update_layout(legend_title_text="Cluster", xaxis_title="City", yaxis_title="Customers", bargap=0.15)
+        pivot = agg["CustomerCount"].unstack(fill_value=0).reset_index()
+        fig_bar = build_stacked_bar(pivot, len(current_cities))
         st.plotly_chart(fig_bar, use_container_width=True)
 
     with rcol:
-        heat = (
-            fdf.pivot_table(index="CustLocation", columns="Cluster", values="AvgTotalMonetary", aggfunc="mean")
-            .fillna(0)
-        )
-        fig_heat = px.imshow(
-            heat,
-            labels=dict(color="Avg Total Monetary"),
-            aspect="auto",
-            title="Avg Total Monetary — Heatmap",
-            color_continuous_scale="Tealrose",
-        )
+        heat = agg["AvgTotalMonetary"].unstack(fill_value=0)
+        fig_heat = build_heatmap(heat)
         st.plotly_chart(fig_heat, use_container_width=True)
 
-    treemap_df = fdf.groupby(["CustLocation", "Cluster"], as_index=False)["CustomerCount"].sum()
-    fig_tree = px.treemap(
-        treemap_df,
-        path=["CustLocation", "Cluster"],
-        values="CustomerCount",
-        color="Cluster",
-        color_discrete_map=CLUSTER_PALETTE,
-        title="Customer Mix Treemap",
-    )
+    treemap_df = agg["CustomerCount"].reset_index()
+    # px.treemap aggregates the color column; plain ints avoid a
+    # "non-ordered Categorical" error now that Cluster is categorical.
+    treemap_df["Cluster"] = treemap_df["Cluster"].astype(int)
+    fig_tree = build_treemap(treemap_df)
     st.plotly_chart(fig_tree, use_container_width=True)
 
     st.markdown("#### Insight Highlights")
-    city_lead = treemap_df.groupby("CustLocation")["CustomerCount"].sum().sort_values(ascending=False).head(3)
-    seg_mix = fdf.groupby("Cluster")["CustomerCount"].sum().sort_values(ascending=False)
+    city_lead = city_totals.sort_values(ascending=False).head(3)
+    seg_mix = agg["CustomerCount"].groupby(level="Cluster", observed=True).sum().sort_values(ascending=False)
     lead_city_txt = ", ".join([f"{c} ({v:,})" for c, v in city_lead.items()]) if not city_lead.empty else "N/A"
     lead_seg_txt = ", ".join([f"Cluster {int(k)} ({int(v):,})" for k, v in seg_mix.items()]) if not seg_mix.empty else "N/A"
     st.info(
@@ -269,28 +526,26 @@ with overview_tab:
 # ----------------------------
 # City Deep‑Dive Tab
 # ----------------------------
-with city_tab:
+if view == "City Deep‑Dive":
     c1, c2 = st.columns([1, 1])
 
     with c1:
-        city_totals = fdf.groupby("CustLocation")["CustomerCount"].sum().reset_index().sort_values("CustomerCount", ascending=False)
-        fig_ct = px.bar(
-            city_totals,
-            x="CustLocation",
-            y="CustomerCount",
-            title="Total Customers by City",
-        )
+        city_totals_df = city_totals.reset_index().sort_values("CustomerCount", ascending=False)
+        fig_ct = build_city_totals_bar(city_totals_df)
         st.plotly_chart(fig_ct, use_container_width=True)
 
     with c2:
         metric_cols = ["AvgFrequency", "AvgTotalMonetary", "AvgRecency"]
         city_profile = (
-            fdf.groupby("CustLocation")[metric_cols].mean().reset_index()
+            agg.groupby(level="CustLocation", observed=True)[metric_cols].mean().reset_index()
         )
         prof_norm = city_profile.copy()
-        for c in metric_cols:
-            rng = prof_norm[c].max() - prof_norm[c].min()
-            prof_norm[c] = 0.5 if rng == 0 else (prof_norm[c] - prof_norm[c].min()) / rng
+        if len(city_profile):  # empty selection: nothing to normalize
+            vals = city_profile[metric_cols].to_numpy()
+            mn = vals.min(axis=0)
+            mx = vals.max(axis=0)
+            rng = np.where(mx == mn, 1.0, mx - mn)
+            prof_norm[metric_cols] = np.where(mx == mn, 0.5, (vals - mn) / rng)
         default_choices = prof_norm.sort_values("AvgTotalMonetary", ascending=False)["CustLocation"].head(3).tolist()
         pick = st.multiselect("Compare up to 4 cities", prof_norm["CustLocation"].tolist(), default=default_choices, max_selections=4)
         pick = pick if pick else default_choices
@@ -300,49 +555,31 @@ with city_tab:
             "AvgTotalMonetary": categories[1],
             "AvgRecency": categories[2],
         })
-        fig_radar = go.Figure()
-        for city in pick:
-            row = prof_plot[prof_plot["CustLocation"] == city][categories].iloc[0].tolist()
-            row.append(row[0])
-            fig_radar.add_trace(go.Scatterpolar(r=row, theta=categories + [categories[0]], fill='toself', name=city, opacity=0.5))
-        fig_radar.update_layout(title="City Profile — Normalized Metrics", polar=dict(radialaxis=dict(visible=True, range=[0,1])), showlegend=True)
+        fig_radar = build_radar(prof_plot, tuple(pick), tuple(categories))
         st.plotly_chart(fig_radar, use_container_width=True)
 
     st.markdown("### Segment Mix & Averages per City")
     col_a, col_b = st.columns(2)
 
     with col_a:
-        mix = (
-            fdf.groupby(["CustLocation", "Cluster"], as_index=False)["CustomerCount"].sum()
-        )
-        fig_mix = px.bar(
-            mix, x="CustLocation", y="CustomerCount", color="Cluster",
-            color_discrete_map=CLUSTER_PALETTE, barmode="group",
-            title="Segment Mix by City (Customers)",
-        )
+        mix = agg["CustomerCount"].reset_index()
+        fig_mix = build_mix_bar(mix)
         st.plotly_chart(fig_mix, use_container_width=True)
 
     with col_b:
-        avg_metrics = (
-            fdf.groupby("CustLocation", as_index=False)[["AvgAge", "AvgFrequency", "AvgTotalMonetary", "AvgRecency"]].mean()
-        )
-        fig_metrics = px.line(
-            avg_metrics.melt(id_vars="CustLocation", var_name="Metric", value_name="Value"),
-            x="CustLocation", y="Value", color="Metric", markers=True,
-            title="Average Metrics by City",
-        )
+        avg_metrics = city_metric_means(fdf, ("AvgAge", "AvgFrequency", "AvgTotalMonetary", "AvgRecency"))
+        fig_metrics = build_metrics_line(avg_metrics)
         st.plotly_chart(fig_metrics, use_container_width=True)
 
 # ----------------------------
 # Segment Explorer Tab
 # ----------------------------
-with segment_tab:
+if view == "Segment Explorer":
     st.markdown("#### Segment Profiles (All Cities in Current Page/Selection)")
 
     seg_summary = (
-        fdf.groupby("Cluster")[[
-            "CustomerCount", "AvgAge", "AvgFrequency", "AvgTotalMonetary", "AvgRecency"
-        ]].agg({
+        agg.groupby(level="Cluster", observed=True)
+        .agg({
             "CustomerCount": "sum",
             "AvgAge": "mean",
             "AvgFrequency": "mean",
@@ -353,43 +590,48 @@ with segment_tab:
 
     st.dataframe(seg_summary, use_container_width=True)
 
-    fig_bubble = px.scatter(
-        seg_summary,
-        x="AvgFrequency", y="AvgTotalMonetary", size="CustomerCount", color="Cluster",
-        color_discrete_sequence=BUBBLE_PALETTE, size_max=64,
-        hover_data={"AvgAge": True, "AvgRecency": True, "CustomerCount": ":,"},
-        title="Segment Positioning (Frequency vs. Spend)",
-    )
-    fig_bubble.update_traces(marker=dict(line=dict(width=1, color="white")))
+    fig_bubble = build_bubble(seg_summary)
     st.plotly_chart(fig_bubble, use_container_width=True)
 
     st.markdown("#### Strategy Suggestions")
-    recs = []
     if not seg_summary.empty:
-        med_spend = seg_summary["AvgTotalMonetary"].median()
-        med_freq = seg_summary["AvgFrequency"].median()
-        for _, row in seg_summary.sort_values("AvgTotalMonetary", ascending=False).iterrows():
-            cid = int(row["Cluster"]) if not math.isnan(row["Cluster"]) else row["Cluster"]
-            if row["AvgTotalMonetary"] >= med_spend and row["AvgFrequency"] >= med_freq:
-                recs.append(f"**Cluster {cid}**: Premium offers & loyalty — high spend and activity.")
-            elif row["AvgTotalMonetary"] >= med_spend:
-                recs.append(f"**Cluster {cid}**: Value‑add bundles to sustain high spend.")
-            elif row["AvgFrequency"] >= med_freq:
-                recs.append(f"**Cluster {cid}**: Cross‑sell bundles — frequent but mid spend.")
-            else:
-                recs.append(f"**Cluster {cid}**: Re‑engagement & onboarding nudges — build activity.")
-
-    st.markdown("\n".join([f"- {r}" for r in recs]) or "No segments in current filter.")
+        ranked = seg_summary.sort_values("AvgTotalMonetary", ascending=False)
+        spend = ranked["AvgTotalMonetary"].to_numpy()
+        freq = ranked["AvgFrequency"].to_numpy()
+        med_spend = np.median(spend)
+        med_freq = np.median(freq)
+        msgs = np.select(
+            [
+                (spend >= med_spend) & (freq >= med_freq),
+                spend >= med_spend,
+                freq >= med_freq,
+            ],
+            [
+                "Premium offers & loyalty — high spend and activity.",
+                "Value‑add bundles to sustain high spend.",
+                "Cross‑sell bundles — frequent but mid spend.",
+            ],
+            default="Re‑engagement & onboarding nudges — build activity.",
+        )
+        recs = [f"- **Cluster {int(c)}**: {m}" for c, m in zip(ranked["Cluster"], msgs)]
+        st.markdown("\n".join(recs))
+    else:
+        st.markdown("No segments in current filter.")
 
 
 # ----------------------------
 # Data & Notes Tab
 # ----------------------------
-with details_tab:
+if view == "Data & Notes":
     st.markdown("#### Filtered Data Preview")
-    st.dataframe(fdf.sort_values(["CustLocation", "Cluster"]).reset_index(drop=True), use_container_width=True)
-
-    csv = fdf.to_csv(index=False).encode("utf-8")
+    # Bound the Arrow payload shipped to the browser; the download button
+    # below still carries the full filtered set.
+    preview = fdf.sort_values(["CustLocation", "Cluster"]).head(500).reset_index(drop=True)
+    st.dataframe(preview, use_container_width=True, height=400)
+    if len(fdf) > 500:
+        st.caption("Showing first 500 rows — use the download button for the full filtered set.")
+
+    csv = to_csv_bytes(fdf)
     st.download_button("⬇️ Download filtered data (CSV)", data=csv, file_name="filtered_top_kpis.csv", mime="text/csv")
 
     st.markdown("---")
@@ -0,0 +1,34 @@
+"""One-time banner preparation for the dashboard.
+
+Fits the source map image to the 1400x350 banner strip (crop-to-fill) and
+saves it as WebP, so app.py can show the banner without running a LANCZOS
+resample on every cold start. Re-run after swapping the source image:
+
+    python make_banner.py
+"""
+import os
+import sys
+
+from PIL import Image, ImageOps
+
+BANNER_CANDIDATES = [
+    "India_map.png", "india_map.png", "india.png", "banner.png", "map.png"
+]
+TARGET_SIZE = (1400, 350)
+OUT_PATH = "banner_1400x350.webp"
+
+
+def main() -> int:
+    src = next((p for p in BANNER_CANDIDATES if os.path.exists(p)), None)
+    if src is None:
+        print(f"No source image found (looked for: {', '.join(BANNER_CANDIDATES)})")
+        return 1
+    img = Image.open(src).convert("RGB")
+    img_fit = ImageOps.fit(img, TARGET_SIZE, method=Image.Resampling.LANCZOS, centering=(0.5, 0.5))
+    img_fit.save(OUT_PATH, format="WEBP", quality=85)
+    print(f"Wrote {OUT_PATH} ({TARGET_SIZE[0]}x{TARGET_SIZE[1]}) from {src}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())